@@ -4,21 +4,150 @@ import face_recognition
 import pandas as pd
 import streamlit as st
 from datetime import datetime, timedelta
+import atexit
 import csv
+import functools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import platform
+import shutil
+import tempfile
+import zipfile
 from pathlib import Path
 from PIL import Image
 import plotly.express as px
 import plotly.graph_objects as go
+from face_encoder import encode_image, encode_images
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+cv2.setUseOptimized(True)
+cv2.setNumThreads(os.cpu_count() or 1)
+
+ENCODINGS_CACHE = Path("encodings/face_encodings.npz")
+MATCH_TOLERANCE = 0.6
+DETECTION_SCALE = 4
+HNSW_MIN_FACES = 10000
+# Side length in pixels at detection scale; HOG can't find faces under ~40px there
+MIN_FACE_SIZE = 48
+MIN_FACE_SHARPNESS = 40.0
+JPEG_QUALITY = 70
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _match_kernel(known, queries, tolerance_sq):
+        """Index of the closest known encoding within tolerance for each query, or -1"""
+        matches = np.full(queries.shape[0], -1, dtype=np.int64)
+        for n in range(queries.shape[0]):
+            best_distance_sq = tolerance_sq
+            for i in range(known.shape[0]):
+                distance_sq = 0.0
+                for j in range(known.shape[1]):
+                    diff = known[i, j] - queries[n, j]
+                    distance_sq += diff * diff
+                    # Stop as soon as this candidate can't beat the best so far
+                    if distance_sq >= best_distance_sq:
+                        break
+                if distance_sq < best_distance_sq:
+                    best_distance_sq = distance_sq
+                    matches[n] = i
+        return matches
+else:
+    _match_kernel = None
+
+
+def capture_frames(cap, frame_queue, stop_event):
+    """Keep only the newest camera frame in frame_queue; puts None if the camera fails"""
+    while not stop_event.is_set():
+        ret, frame = cap.read()
+        try:
+            frame_queue.get_nowait()
+        except queue.Empty:
+            pass
+        frame_queue.put(frame if ret else None)
+        if not ret:
+            break
+
+
+@functools.lru_cache(maxsize=512)
+def _row_count(path_str, mtime):
+    """Count data rows in a CSV file; mtime is part of the cache key"""
+    with open(path_str, "rb") as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def file_mtime(path):
+    """Modification time of a file, or None if it doesn't exist"""
+    try:
+        return Path(path).stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def attendance_count(attendance_file, mtime=None):
+    """Number of students in an attendance file, 0 if it doesn't exist"""
+    if mtime is None:
+        mtime = file_mtime(attendance_file)
+        if mtime is None:
+            return 0
+    return _row_count(str(attendance_file), mtime)
+
+
+@st.cache_data(ttl=30)
+def _dashboard_metrics(attendance_file, attendance_mtime, total_students):
+    """Dashboard metrics, recomputed only when today's file or the student count changes"""
+    present_students = attendance_count(attendance_file, attendance_mtime) if attendance_mtime else 0
+    
+    absent_students = total_students - present_students
+    attendance_rate = (present_students / total_students * 100) if total_students > 0 else 0
+    
+    return {
+        "total_students": total_students,
+        "present_today": present_students,
+        "absent_today": absent_students,
+        "attendance_rate": attendance_rate
+    }
+
+
+@st.cache_data(ttl=30)
+def _weekly_trend(file_mtimes):
+    """Attendance counts for (date, file, mtime) tuples, cached on the mtimes"""
+    dates = [date for date, _, _ in file_mtimes]
+    attendance_counts = [
+        attendance_count(attendance_file, mtime) if mtime else 0
+        for _, attendance_file, mtime in file_mtimes
+    ]
+    return dates, attendance_counts
+
 
 class EnhancedAttendanceSystem:
     def __init__(self):
+        self._lock = threading.RLock()
+        self._frame_buffers = threading.local()
+        self._marked_today = {}
+        self._day_writers = {}
+        self._last_flush = 0.0
+        atexit.register(self.close_writers)
         self.initialize_system()
+        self._students_df = pd.read_csv("students.csv", dtype="string")
         self.load_known_faces()
         
     def initialize_system(self):
         """Initialize necessary directories and files"""
         # Create required directories
-        for directory in ["dataset", "attendance_records"]:
+        for directory in ["dataset", "encodings", "attendance_records"]:
             Path(directory).mkdir(exist_ok=True)
         
         # Initialize students.csv if it doesn't exist
@@ -36,96 +165,314 @@ class EnhancedAttendanceSystem:
                 writer.writerow(["enable_email", "True"])
                 writer.writerow(["enable_whatsapp", "True"])
 
+        self.check_dlib_build()
+
+    def check_dlib_build(self):
+        """Report GPU acceleration and warn if dlib is missing CPU/GPU support"""
+        import dlib
+
+        self.use_cuda = bool(getattr(dlib, "DLIB_USE_CUDA", False)) and dlib.cuda.get_num_devices() > 0
+        if self.use_cuda:
+            st.info("GPU acceleration active")
+        elif shutil.which("nvidia-smi"):
+            print(
+                "NVIDIA GPU detected but dlib was built without CUDA. Rebuild it with: "
+                "DLIB_USE_CUDA=YES scripts/build_dlib.sh "
+                "(or pip install --no-binary dlib dlib with --set DLIB_USE_CUDA=YES)"
+            )
+
+        if platform.machine().lower() in ("x86_64", "amd64", "i386", "i686"):
+            if not getattr(dlib, "USE_AVX_INSTRUCTIONS", getattr(dlib, "DLIB_USE_AVX_INSTRUCTIONS", False)):
+                st.warning(
+                    "dlib was built without AVX, so face encoding runs much slower than it could. "
+                    "Rebuild it with scripts/build_dlib.sh (CFLAGS='-O3 -mavx -mavx2')."
+                )
+
     def load_known_faces(self):
-        """Load known faces and their encodings from the dataset"""
-        self.known_face_encodings = []
-        self.known_face_ids = []
-        
-        for image_path in Path("dataset").glob("*.jpg"):
+        """Load known faces, re-encoding only images changed since the cache was written"""
+        try:
+            with np.load(ENCODINGS_CACHE) as cache:
+                cached_ids = [str(student_id) for student_id in cache["ids"]]
+                cached_mtimes = cache["mtimes"]
+                cached_encodings = cache["encodings"].astype(np.float32)
+                cached_no_face = dict(zip((str(student_id) for student_id in cache["no_face_ids"]), cache["no_face_mtimes"]))
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            cached_ids, cached_mtimes = [], np.empty(0)
+            cached_encodings = np.empty((0, 128), dtype=np.float32)
+            cached_no_face = {}
+        cached_index = {student_id: i for i, student_id in enumerate(cached_ids)}
+
+        # Images with no detectable face are remembered too, so they are only
+        # re-encoded once their mtime changes
+        ids, mtimes, rows, stale = [], [], [], []
+        self._no_face = {}
+        for image_path in sorted(Path("dataset").glob("*.jpg")):
+            student_id = image_path.stem
+            mtime = image_path.stat().st_mtime
+            i = cached_index.get(student_id)
+            if i is not None and cached_mtimes[i] == mtime:
+                ids.append(student_id)
+                mtimes.append(mtime)
+                rows.append(i)
+            elif cached_no_face.get(student_id) == mtime:
+                self._no_face[student_id] = mtime
+            else:
+                stale.append((image_path, mtime))
+
+        # Encode new or changed images across all cores on a cold start. Starting
+        # workers costs more than a few encodings, and with CUDA dlib already
+        # batches on the GPU, so small batches and CUDA builds encode serially.
+        stale_paths = [image_path for image_path, _ in stale]
+        cpu_count = os.cpu_count() or 1
+        if cpu_count > 1 and len(stale_paths) >= cpu_count and not self.use_cuda:
+            stale_encodings = encode_images(stale_paths, max_workers=min(cpu_count, len(stale_paths)))
+        else:
+            stale_encodings = [encode_image(image_path) for image_path in stale_paths]
+
+        new_encodings = []
+        for (image_path, mtime), encoding in zip(stale, stale_encodings):
+            if encoding is not None:
+                ids.append(image_path.stem)
+                mtimes.append(mtime)
+                new_encodings.append(encoding)
+            else:
+                self._no_face[image_path.stem] = mtime
+
+        self.known_face_ids = ids
+        self._known_face_mtimes = mtimes
+        self.known_face_encodings = np.ascontiguousarray(
+            np.vstack([cached_encodings[rows], np.reshape(new_encodings, (-1, 128))]), dtype=np.float32
+        )
+        if stale or len(rows) != len(cached_ids) or self._no_face != cached_no_face:
+            self._save_encoding_cache()
+        self._build_index()
+
+    def _build_index(self):
+        """Precompute squared norms of the known encodings and build the FAISS index, if installed"""
+        self._known_sq_norms = np.einsum("ij,ij->i", self.known_face_encodings, self.known_face_encodings)
+        self._index = None
+        if faiss is None:
+            return
+        if len(self.known_face_encodings) >= HNSW_MIN_FACES:
+            self._index = faiss.IndexHNSWFlat(128, 32)
+        else:
+            self._index = faiss.IndexFlatL2(128)
+        self._index.add(self.known_face_encodings)
+
+    def add_known_face(self, student_id, mtime, encoding):
+        """Add or replace a single known face without touching the others"""
+        with self._lock:
+            encoding = np.asarray(encoding, dtype=np.float32)
+            self._no_face.pop(student_id, None)
+            if student_id in self.known_face_ids:
+                i = self.known_face_ids.index(student_id)
+                self._known_face_mtimes[i] = mtime
+                self.known_face_encodings[i] = encoding
+                self._build_index()
+            else:
+                self.known_face_ids.append(student_id)
+                self._known_face_mtimes.append(mtime)
+                self.known_face_encodings = np.ascontiguousarray(np.vstack([self.known_face_encodings, encoding]))
+                self._known_sq_norms = np.append(self._known_sq_norms, encoding @ encoding)
+                if self._index is not None:
+                    self._index.add(encoding[None])
+            self._save_encoding_cache()
+
+    def _save_encoding_cache(self):
+        """Persist ids, image mtimes, float16 encodings and face-less images as parallel arrays"""
+        # Write to a temp file and swap it in, so a crash never leaves a truncated cache
+        with tempfile.NamedTemporaryFile(dir=ENCODINGS_CACHE.parent, suffix=".npz", delete=False) as f:
+            tmp_path = f.name
             try:
-                image = face_recognition.load_image_file(str(image_path))
-                encodings = face_recognition.face_encodings(image)
-                if encodings:
-                    self.known_face_encodings.append(encodings[0])
-                    self.known_face_ids.append(image_path.stem)
-            except Exception as e:
-                print(f"Error loading {image_path}: {e}")
+                np.savez(
+                    f,
+                    ids=np.array(self.known_face_ids, dtype=str),
+                    mtimes=np.array(self._known_face_mtimes, dtype=np.float64),
+                    encodings=self.known_face_encodings.astype(np.float16),
+                    no_face_ids=np.array(list(self._no_face), dtype=str),
+                    no_face_mtimes=np.array(list(self._no_face.values()), dtype=np.float64),
+                )
+            except BaseException:
+                f.close()
+                os.remove(tmp_path)
+                raise
+        os.replace(tmp_path, ENCODINGS_CACHE)
 
     def recognize_face(self, frame):
         """Recognize faces in the frame"""
-        # Convert frame to RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # Detect on a downscaled RGB copy of the frame, reusing the same buffers
+        # every frame. dlib needs a C-contiguous array, so frame[:, :, ::-1] won't do.
+        # Buffers are per thread since sessions share this instance.
+        buffers = self._frame_buffers
+        height, width = frame.shape[0] // DETECTION_SCALE, frame.shape[1] // DETECTION_SCALE
+        if getattr(buffers, "small", None) is None or buffers.small.shape != (height, width, 3):
+            buffers.small = np.empty((height, width, 3), dtype=np.uint8)
+            buffers.rgb = np.empty_like(buffers.small)
+        cv2.resize(frame, (width, height), dst=buffers.small)
+        rgb_small_frame = cv2.cvtColor(buffers.small, cv2.COLOR_BGR2RGB, dst=buffers.rgb)
+        
+        # Find all faces in the frame, skipping ones too small or blurry to match
+        small_locations = [
+            location for location in face_recognition.face_locations(rgb_small_frame, model="hog")
+            if self.is_usable_face(frame, location)
+        ]
         
-        # Find all faces in the frame
-        face_locations = face_recognition.face_locations(rgb_frame)
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        # Encode the remaining faces in one call
+        face_encodings = face_recognition.face_encodings(
+            rgb_small_frame, small_locations, num_jitters=0, model="small"
+        )
+        
+        # Scale face locations back to the full frame
+        face_locations = [
+            tuple(coord * DETECTION_SCALE for coord in location) for location in small_locations
+        ]
         
         recognized_students = []
         
-        for face_encoding in face_encodings:
-            if len(self.known_face_encodings) > 0:
-                matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-                if True in matches:
-                    first_match_index = matches.index(True)
-                    student_id = self.known_face_ids[first_match_index]
-                    recognized_students.append(student_id)
+        if face_encodings and len(self.known_face_encodings) > 0:
+            best_matches = self.match_faces(np.asarray(face_encodings, dtype=np.float32))
+            recognized_students = [self.known_face_ids[i] for i in best_matches if i >= 0]
         
         return recognized_students, face_locations
 
+    def is_usable_face(self, frame, small_location):
+        """Check a detected face is large and sharp enough to be worth encoding"""
+        top, right, bottom, left = small_location
+        if (bottom - top) * (right - left) < MIN_FACE_SIZE * MIN_FACE_SIZE:
+            return False
+        
+        top, right, bottom, left = (coord * DETECTION_SCALE for coord in small_location)
+        gray_face = cv2.cvtColor(frame[max(top, 0):bottom, max(left, 0):right], cv2.COLOR_BGR2GRAY)
+        return cv2.Laplacian(gray_face, cv2.CV_64F).var() > MIN_FACE_SHARPNESS
+
+    def match_faces(self, face_encodings):
+        """Return the index of the closest known face for each encoding, or -1 if none is within tolerance"""
+        with self._lock:
+            if self._index is not None:
+                distances_sq, indices = self._index.search(np.ascontiguousarray(face_encodings), 1)
+                distances_sq, indices = distances_sq[:, 0], indices[:, 0]
+            elif _match_kernel is not None:
+                return _match_kernel(self.known_face_encodings, np.ascontiguousarray(face_encodings), MATCH_TOLERANCE ** 2)
+            else:
+                # |k - q|^2 = |k|^2 - 2 k.q + |q|^2, so one BLAS matrix product scores every pair
+                all_distances_sq = (
+                    self._known_sq_norms[None, :]
+                    - 2 * (face_encodings @ self.known_face_encodings.T)
+                    + np.einsum("ij,ij->i", face_encodings, face_encodings)[:, None]
+                )
+                indices = all_distances_sq.argmin(axis=1)
+                distances_sq = all_distances_sq[np.arange(len(indices)), indices]
+        
+            return np.where(distances_sq < MATCH_TOLERANCE ** 2, indices, -1)
+
     def mark_attendance(self, student_id):
         """Mark attendance for a student"""
-        today = datetime.now().date()
-        attendance_file = f"attendance_records/attendance_{today}.csv"
-        current_time = datetime.now().strftime("%H:%M:%S")
+        with self._lock:
+            today = datetime.now().date()
+            attendance_file = f"attendance_records/attendance_{today}.csv"
+            current_time = datetime.now().strftime("%H:%M:%S")
         
-        # Create attendance file for today if it doesn't exist
-        if not Path(attendance_file).exists():
-            with open(attendance_file, "w", newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(["Student ID", "Time"])
+            # Check if student already marked attendance today
+            if today not in self._marked_today:
+                self._marked_today = {today: self._load_marked_ids(attendance_file)}
+            marked = self._marked_today[today]
+            student_id = str(student_id)
+            if student_id in marked:
+                return False
         
-        # Check if student already marked attendance today
-        df = pd.read_csv(attendance_file)
-        if student_id not in df['Student ID'].values:
-            with open(attendance_file, "a", newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([student_id, current_time])
+            f, writer = self._writer_for(today, attendance_file)
+            writer.writerow([student_id, current_time])
+            marked.add(student_id)
+        
+            # Flush at most once per second; readers call flush_writers() first
+            now = time.monotonic()
+            if now - self._last_flush > 1.0:
+                f.flush()
+                self._last_flush = now
             return True
-        return False
+
+    def _writer_for(self, today, attendance_file):
+        """Return the open (file, csv.writer) for today's attendance file"""
+        if today not in self._day_writers:
+            self.close_writers()
+            
+            # Create attendance file for today if it doesn't exist
+            new_file = not Path(attendance_file).exists()
+            f = open(attendance_file, "a", newline='')
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(["Student ID", "Time"])
+            self._day_writers[today] = (f, writer)
+        return self._day_writers[today]
+
+    def flush_writers(self):
+        """Write any buffered attendance rows to disk"""
+        with self._lock:
+            for f, _ in self._day_writers.values():
+                f.flush()
+            self._last_flush = time.monotonic()
+
+    def close_writers(self):
+        """Flush and close all open attendance files"""
+        with self._lock:
+            for f, _ in self._day_writers.values():
+                f.close()
+            self._day_writers = {}
+
+    def _load_marked_ids(self, attendance_file):
+        """Read the student IDs already marked in an attendance file"""
+        try:
+            with open(attendance_file, newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                return {row[0] for row in reader if row}
+        except FileNotFoundError:
+            return set()
 
     def get_attendance_records(self, start_date, end_date):
         """Get attendance records between two dates"""
+        self.flush_writers()
         records = []
-        current_date = start_date
         
-        while current_date <= end_date:
-            attendance_file = f"attendance_records/attendance_{current_date}.csv"
-            if Path(attendance_file).exists():
-                df = pd.read_csv(attendance_file)
-                df['Date'] = current_date
+        for attendance_file in sorted(Path("attendance_records").glob("attendance_*.csv")):
+            try:
+                record_date = datetime.strptime(attendance_file.stem[len("attendance_"):], "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            if start_date <= record_date <= end_date:
+                df = pd.read_csv(attendance_file, dtype={"Student ID": "string", "Time": "string"})
+                df['Date'] = record_date
                 records.append(df)
-            current_date += timedelta(days=1)
             
         if records:
             combined_records = pd.concat(records, ignore_index=True)
-            students_df = pd.read_csv("students.csv")
-            return combined_records.merge(students_df, on="Student ID", how="left")
+            return combined_records.merge(self.students(), on="Student ID", how="left")
         return pd.DataFrame()
 
+    def students(self):
+        """Registered students, loaded from students.csv once"""
+        return self._students_df
+
     def register_student(self, student_id, name, image_data, email, phone, rfid=None):
         """Register a new student"""
         try:
             # Save student info
-            with open("students.csv", "a", newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([student_id, name, email, phone, rfid])
+            student = pd.DataFrame(
+                [{"Student ID": student_id, "Name": name, "Email": email, "Phone": phone, "RFID": rfid}],
+                dtype="string",
+            )
+            with self._lock:
+                self._students_df = pd.concat([self._students_df, student], ignore_index=True)
+                self._students_df.to_csv("students.csv", index=False)
             
             # Save student image
             img_path = f"dataset/{student_id}.jpg"
             image_data.save(img_path)
             
-            # Reload known faces
-            self.load_known_faces()
+            # Encode only the new face and add it to the cache
+            encoding = encode_image(img_path)
+            if encoding is not None:
+                self.add_known_face(str(student_id), Path(img_path).stat().st_mtime, encoding)
             return True
         except Exception as e:
             print(f"Error registering student: {e}")
@@ -133,40 +480,25 @@ class EnhancedAttendanceSystem:
 
     def get_dashboard_metrics(self):
         """Get metrics for dashboard"""
-        total_students = len(pd.read_csv("students.csv"))
-        
+        self.flush_writers()
         today = datetime.now().date()
         attendance_file = f"attendance_records/attendance_{today}.csv"
-        
-        if Path(attendance_file).exists():
-            present_students = len(pd.read_csv(attendance_file))
-        else:
-            present_students = 0
-            
-        absent_students = total_students - present_students
-        attendance_rate = (present_students / total_students * 100) if total_students > 0 else 0
-        
-        return {
-            "total_students": total_students,
-            "present_today": present_students,
-            "absent_today": absent_students,
-            "attendance_rate": attendance_rate
-        }
+        return _dashboard_metrics(attendance_file, file_mtime(attendance_file), len(self.students()))
 
     def get_weekly_trend(self):
         """Get weekly attendance trend data"""
-        dates = [(datetime.now() - timedelta(days=x)).date() for x in range(6, -1, -1)]
-        attendance_counts = []
-        
-        for date in dates:
+        self.flush_writers()
+        today = datetime.now().date()
+        file_mtimes = []
+        for date in (today - timedelta(days=x) for x in range(6, -1, -1)):
             attendance_file = f"attendance_records/attendance_{date}.csv"
-            if Path(attendance_file).exists():
-                count = len(pd.read_csv(attendance_file))
-            else:
-                count = 0
-            attendance_counts.append(count)
-            
-        return dates, attendance_counts
+            file_mtimes.append((date, attendance_file, file_mtime(attendance_file)))
+        return _weekly_trend(tuple(file_mtimes))
+
+@st.cache_resource
+def get_attendance_system():
+    """Create the attendance system once per process"""
+    return EnhancedAttendanceSystem()
 
 def create_ui():
     """Create the main UI"""
@@ -197,9 +529,9 @@ def create_ui():
         </style>
     """, unsafe_allow_html=True)
     
-    # Initialize system
+    # Initialize system, shared by every session in this process
     if 'attendance_system' not in st.session_state:
-        st.session_state.attendance_system = EnhancedAttendanceSystem()
+        st.session_state.attendance_system = get_attendance_system()
         st.session_state.camera_active = False
         st.session_state.marked_today = set()
     
@@ -299,31 +631,64 @@ def show_attendance_page():
             if st.session_state.camera_active:
                 stframe = st.empty()
                 cap = cv2.VideoCapture(0)
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                cap.set(cv2.CAP_PROP_FPS, 15)
                 
-                while st.session_state.camera_active:
-                    ret, frame = cap.read()
-                    if not ret:
-                        st.error("Failed to access camera")
-                        break
-                    
-                    # Recognize faces
-                    recognized_students, face_locations = st.session_state.attendance_system.recognize_face(frame)
-                    
-                    # Draw rectangles around faces
-                    for (top, right, bottom, left), student_id in zip(face_locations, recognized_students):
-                        cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                        cv2.putText(frame, student_id, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-                    
-                    # Mark attendance for recognized students
-                    for student_id in recognized_students:
-                        if student_id not in st.session_state.marked_today:
-                            if st.session_state.attendance_system.mark_attendance(student_id):
-                                st.session_state.marked_today.add(student_id)
-                                st.success(f"Attendance marked for Student {student_id}")
-                    
-                    stframe.image(frame, channels="BGR")
+                # Capture on a background thread and recognize on a single worker so
+                # the display keeps up with the camera while recognition runs
+                frame_queue = queue.Queue(maxsize=1)
+                stop_event = threading.Event()
+                producer = threading.Thread(target=capture_frames, args=(cap, frame_queue, stop_event), daemon=True)
+                producer.start()
+                executor = ThreadPoolExecutor(max_workers=1)
+                future = None
+                recognized_students, face_locations = [], []
                 
-                cap.release()
+                try:
+                    while st.session_state.camera_active:
+                        # A slow frame (camera warm-up, a long dlib call) is not a
+                        # failure; only the None sentinel or a dead producer is
+                        try:
+                            frame = frame_queue.get(timeout=1.0)
+                        except queue.Empty:
+                            if producer.is_alive():
+                                continue
+                            frame = None
+                        if frame is None:
+                            st.error("Failed to access camera")
+                            break
+                        
+                        # Collect the latest recognition result and mark attendance
+                        if future is not None and future.done():
+                            recognized_students, face_locations = future.result()
+                            future = None
+                            for student_id in recognized_students:
+                                if student_id not in st.session_state.marked_today:
+                                    if st.session_state.attendance_system.mark_attendance(student_id):
+                                        st.session_state.marked_today.add(student_id)
+                                        st.success(f"Attendance marked for Student {student_id}")
+                        
+                        # Hand the newest frame to the worker once it is free
+                        if future is None:
+                            future = executor.submit(st.session_state.attendance_system.recognize_face, frame.copy())
+                        
+                        # Draw the most recent face boxes
+                        for (top, right, bottom, left), student_id in zip(face_locations, recognized_students):
+                            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+                            cv2.putText(frame, student_id, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                        
+                        # Send JPEG bytes so Streamlit doesn't PNG-encode the raw array
+                        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                        if ok:
+                            stframe.image(jpeg.tobytes())
+                finally:
+                    stop_event.set()
+                    producer.join(timeout=1.0)
+                    executor.shutdown(wait=False)
+                    cap.release()
+                    st.session_state.attendance_system.flush_writers()
         
         with col2:
             st.subheader("Recently Marked")
@@ -0,0 +1,33 @@
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import face_recognition
+
+
+def encode_image(image_path):
+    """Return the face encoding of the first face in an image, or None"""
+    try:
+        image = face_recognition.load_image_file(str(image_path))
+        encodings = face_recognition.face_encodings(image)
+        if encodings:
+            return encodings[0]
+    except Exception as e:
+        print(f"Error loading {image_path}: {e}")
+    return None
+
+
+def encode_images(image_paths, max_workers):
+    """Encode images in parallel worker processes, returning encodings (or None) in order"""
+    # Spawned workers re-import the parent's __main__. Point it at this module while
+    # the workers start so they import face_recognition only, not the Streamlit app.
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[__name__]
+    try:
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        futures = [executor.submit(encode_image, image_path) for image_path in image_paths]
+    finally:
+        sys.modules["__main__"] = main_module
+
+    with executor:
+        return [future.result() for future in futures]
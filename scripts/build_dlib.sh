@@ -0,0 +1,46 @@
+#!/usr/bin/env bash
+# Build and install dlib from source with SIMD instructions enabled.
+# Usage: scripts/build_dlib.sh
+#   DLIB_VERSION=x.y.z   build a different dlib version
+#   DLIB_USE_CUDA=YES    also link against CUDA (requires the CUDA toolkit and cuDNN)
+#   PYTHON=/path/python  interpreter to build and install for (default: python3)
+set -euo pipefail
+
+# Build, uninstall and install with the same interpreter so the wheel lands
+# in the environment the app runs in
+PYTHON="${PYTHON:-python3}"
+
+DLIB_VERSION="${DLIB_VERSION:-19.24.2}"
+workdir="$(mktemp -d)"
+trap 'rm -rf "$workdir"' EXIT
+
+"$PYTHON" -m pip download --no-binary :all: --no-deps "dlib==${DLIB_VERSION}" -d "$workdir"
+tar -xzf "$workdir"/dlib-*.tar.gz -C "$workdir"
+cd "$workdir/dlib-${DLIB_VERSION}"
+
+case "$(uname -m)" in
+    x86_64|amd64|i?86)
+        simd=(--set USE_AVX_INSTRUCTIONS=YES --compiler-flags "-O3 -mavx -mavx2")
+        ;;
+    aarch64|arm64)
+        # NEON is always available on 64-bit ARM; -mfpu is not a valid flag there
+        simd=(--set USE_NEON_INSTRUCTIONS=YES --compiler-flags "-O3")
+        ;;
+    arm*)
+        simd=(--set USE_NEON_INSTRUCTIONS=YES --compiler-flags "-O3 -mfpu=neon")
+        ;;
+    *)
+        simd=(--compiler-flags "-O3")
+        ;;
+esac
+
+if [ "${DLIB_USE_CUDA:-NO}" = "YES" ]; then
+    simd+=(--set DLIB_USE_CUDA=YES)
+fi
+
+# Build a wheel first so a failed build leaves the existing dlib installed
+"$PYTHON" -m pip install wheel
+"$PYTHON" setup.py bdist_wheel --set DLIB_NO_GUI_SUPPORT=YES "${simd[@]}"
+
+"$PYTHON" -m pip uninstall -y dlib
+"$PYTHON" -m pip install --no-deps dist/dlib-*.whl